@@ -1,12 +1,45 @@
 import argparse
+import re
 import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache, partial
 from pathlib import Path
 
 from rich.console import Console
 from rich.markdown import Markdown
 
-from query import Query
+from query import PARALLEL_DOWNLOADS, Query, create_session
+
+
+QUERY_BATCH_SIZE = 8  # issue numbers searched for at once when -min or -max is set
+DATE_SEPARATORS = re.compile(r"[/.\-\\\s]+")
+MONTHS = {
+	"january": 1,
+	"february": 2,
+	"march": 3,
+	"april": 4,
+	"june": 6,
+	"july": 7,
+	"august": 8,
+	"september": 9,
+	"october": 10, 
+	"november": 11,
+	"december": 12,
+	"jan": 1,
+	"feb": 2,
+	"mar": 3,
+	"apr": 4,
+	"may": 5,
+	"jun": 6,
+	"jul": 7,
+	"aug": 8,
+	"sep": 9,
+	"oct": 10,
+	"nov": 11,
+	"dec": 12
+}
 
 
 def parse_arguments():
@@ -52,6 +85,11 @@ def parse_arguments():
 		help="Number of results to retrieve (default: 0, for infinite)"
 	)
 
+	# Optional argument for the number of simultaneous downloads
+	parser.add_argument("-parallel", dest="parallel", type=int, default=PARALLEL_DOWNLOADS,
+		help=f"Number of comics to download at once (default: {PARALLEL_DOWNLOADS})"
+	)
+
 	# Optional argument for testing
 	parser.add_argument("-test", "--t", dest="test", action="store_true", default=False,
 		help="Enable test mode (default: False)"
@@ -75,6 +113,10 @@ def parse_arguments():
 		if args.verbose:
 			print(f"Searching for comics released on/since {args.date.strftime('%d-%B-%Y')}")
 	
+	if args.parallel < 1:
+		print("You must specify -parallel argument as a number greater than 0.")
+		sys.exit(1)
+
 	if args.min and args.max:
 		if args.max < args.min:
 			print("You must specify -max argument as a number greater than -min argument.")
@@ -85,6 +127,7 @@ def parse_arguments():
 	return args
 
 
+@lru_cache(maxsize=1024)
 def is_date(date, return_datetime=False) -> [bool, datetime]:  
 	"""
 	date (str) - date to check if valid
@@ -101,13 +144,7 @@ def is_date(date, return_datetime=False) -> [bool, datetime]:
 		except:
 			raise TypeError("Argument 'return_datetime': invalid format string (ie should be '%d-%m-%Y' etc)")
 	
-	for char in ["/", ".", "-", "\\"]:
-		date = date.replace(char, "-")
-	
-	if "-" in date:
-		date_split = date.split("-")
-	elif " " in date:
-		date_split = date.split()
+	date_split = DATE_SEPARATORS.split(date.strip())
 	date_split_original = date_split[:]
 
 	if len(date_split) != 3:
@@ -124,7 +161,7 @@ def is_date(date, return_datetime=False) -> [bool, datetime]:
 	# determine day/month if year known
 	for i, part in enumerate(date_split):
 		# if all digits are the same, that makes life easy
-		if all([num == date_split[0] for num in date_split]):
+		if len(set(date_split)) == 1:
 			date["day"] = int(date_split.pop())
 			date["month"] = int(date_split.pop())
 			if not date.get("year"):
@@ -152,39 +189,14 @@ def is_date(date, return_datetime=False) -> [bool, datetime]:
 				break
 
 	# determine month
-	months = {
-		"january": 1,
-		"february": 2,
-		"march": 3,
-		"april": 4,
-		"june": 6,
-		"july": 7,
-		"august": 8,
-		"september": 9,
-		"october": 10, 
-		"november": 11,
-		"december": 12,
-		"jan": 1,
-		"feb": 2,
-		"mar": 3,
-		"apr": 4,
-		"may": 5,
-		"jun": 6,
-		"jul": 7,
-		"aug": 8,
-		"sep": 9,
-		"oct": 10,
-		"nov": 11,
-		"dec": 12
-	}
 	for i, part in enumerate(date_split):
 		# if we already determined the month, skip this
 		if date.get("month"):
 			break
 		# if its a string and matches a month name
-		if not part.isdigit() and months.get(part.lower()):
+		if not part.isdigit() and MONTHS.get(part.lower()):
 			date_split.pop(i)
-			date["month"] = months.get(part.lower())
+			date["month"] = MONTHS.get(part.lower())
 			continue  # don't break, in case there are 2 strings we'll fail later
 		# if year and day are known, it is the remaining item
 		if date.get("year") and date.get("day") and date_split:
@@ -232,50 +244,108 @@ def get_query_string(i, query, _min=None, _max=None):
 	return query
 
 
+def search(queries, console, date=None):
+	"""
+	Runs all of the queries at once, finding their pages and then the download links on those pages.
+	"""
+	# a single query is run on this thread, where Ctrl-C stops it straight away
+	executor = ThreadPoolExecutor(max_workers=len(queries)) if len(queries) > 1 else None
+	try:
+		with console.status("Querying getcomics.info for search results...") as status:
+			run_all(executor, [partial(query.find_pages, date=date) for query in queries])
+		num_pages = sum(len(query.page_links) for query in queries)
+		with console.status(f"Querying {num_pages:,} search results for download links...") as status:
+			run_all(executor, [query.get_download_links for query in queries])
+	except BaseException:
+		# have the other queries give up rather than waiting for them to finish, eg: on KeyboardInterrupt
+		for query in queries:
+			query.stop()
+		raise
+	finally:
+		if executor is not None:
+			executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_all(executor, calls):
+	"""
+	Runs each of the calls, at once on the executor if given, otherwise one after another.
+	"""
+	if executor is None:
+		for call in calls:
+			call()
+		return
+	for future in [executor.submit(call) for call in calls]:
+		future.result()
+
+
+def show_results(query, args, console):
+	"""
+	Lists what a query found if testing or verbose, then downloads it unless testing.
+	"""
+	print()
+	if (args.test or args.verbose) and query.page_links:
+		comics_by_title = defaultdict(list)
+		for comic_url, comic_title in query.comic_links.items():
+			comics_by_title[comic_title].append(comic_url)
+
+		console.print(Markdown(f"## {query.query}"))
+		for page_index, (page_url, page_title) in enumerate(query.page_links.items(), start=1):
+			console.print(f"\n{page_index}) [bold]{page_title}[/bold]\nPage: {page_url}\nComic links on page:")
+			for comic_url in comics_by_title.get(page_title, ()):
+				print(f"  • {comic_url}")
+
+	if not query.page_links:
+		print(f"No results found for query '{query.query}'")
+	elif not args.test:
+		query.download_comics(args.prompt, args.parallel)
+
+
 def main():
 	args = parse_arguments()
 	console = Console(highlight=False)
 
 	try:
-		i = -1
-		failed_to_find_comics = 0
-		while True: # loop used to continue searching for issues until one cannot be found, if args.newer set
-			i += 1
-			if args.max and (args.min + i) > args.max:
-				break
-
-			query_string = get_query_string(i, args.query, _min=args.min, _max=args.max)
-			query = Query(query_string, args.results, args.verbose, args.download_path)
-			
-			print()
-			with console.status("Querying getcomics.info for search results...") as status:
-				query.find_pages(date=args.date)
-			with console.status(f"Querying {len(query.page_links):,} search results for download links...") as status:
-				query.get_download_links()
-
-			if (args.test or args.verbose) and query.page_links:
-				console.print(Markdown(f"## {query_string}"))
-				for page_index, (page_url, page_title) in enumerate(query.page_links.items(), start=1):
-					console.print(f"\n{page_index}) [bold]{page_title}[/bold]\nPage: {page_url}\nComic links on page:")
-					for comic_url, comic_title in query.comic_links.items():
-						if comic_title == page_title:
-							print(f"  • {comic_url}")
-			
-			if not query.page_links:
-				print(f"No results found for query '{query_string}'")
-			elif not args.test:
-				query.download_comics(args.prompt)
-
-			if args.min or args.max:
-				# break if it is (3 or -results) times in a row that we've failed to find comics
-				if not query.page_links:
-					failed_to_find_comics += 1
-					if failed_to_find_comics == max(args.results, 3):
-						break
+		with create_session() as session:
+			i = 0
+			failed_to_find_comics = 0
+			finished = False
+			while not finished: # loop used to continue searching for issues until one cannot be found, if -min/-max set
+				if not (args.min or args.max):
+					batch_size = 1
+					finished = True
+				elif args.max:
+					# search the next few issue numbers at once, but not past -max
+					batch_size = min(QUERY_BATCH_SIZE, args.max - (args.min + i) + 1)
 				else:
-					failed_to_find_comics = 0
-			else:
-				break
+					batch_size = QUERY_BATCH_SIZE
+				if batch_size < 1:
+					break
+
+				queries = [
+					Query(
+						get_query_string(i + j, args.query, _min=args.min, _max=args.max),
+						args.results, args.verbose, args.download_path, session=session
+					)
+					for j in range(batch_size)
+				]
+				i += batch_size
+				try:
+					search(queries, console, date=args.date)
+					for query in queries:
+						show_results(query, args, console)
+
+						if args.min or args.max:
+							# stop if it is (3 or -results) times in a row that we've failed to find comics
+							if not query.page_links:
+								failed_to_find_comics += 1
+								if failed_to_find_comics == max(args.results, 3):
+									finished = True
+									break
+							else:
+								failed_to_find_comics = 0
+				finally:
+					for query in queries:
+						query.close()
 	except KeyboardInterrupt:
 		sys.exit(1)
 
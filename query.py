@@ -1,68 +1,264 @@
-import re
+import json
+import math
+import os
+import queue
 import shutil
 import tempfile
 import textwrap
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from functools import partial
+from itertools import islice
 from pathlib import Path
 from urllib.parse import quote_plus, unquote
 
 import requests
-from bs4 import BeautifulSoup
+import urllib3
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from requests_cache import DO_NOT_CACHE, CachedSession
+from selectolax.parser import HTMLParser
+from rich.filesize import pick_unit_and_suffix
 from rich.progress import Progress, BarColumn, DownloadColumn, TextColumn, TimeRemainingColumn, TransferSpeedColumn
+from urllib3.util.retry import Retry
 
 
 BASE_URL = "https://getcomics.info"
+MAX_CONCURRENT_REQUESTS = 8  # upper bound on simultaneous page fetches, to go easy on the host
+PARALLEL_DOWNLOADS = 4  # default number of comics downloaded at once
+DOWNLOAD_CHUNK_SIZE = 256 * 1024  # bytes read from a download at a time, small enough to keep the progress bar moving
+WRITE_BUFFER_SIZE = 1 << 20  # bytes buffered per write to disk
+REQUEST_TIMEOUT = (10, 30)  # seconds to wait to connect, and between bytes received, before giving up on a request
+DOWNLOAD_ATTEMPTS = 5  # times a download is tried before giving up
+# errors from a dropped or stalled connection, after which a download is worth resuming
+RETRYABLE_DOWNLOAD_ERRORS = (
+	requests.exceptions.ConnectionError,
+	requests.exceptions.Timeout,
+	requests.exceptions.ChunkedEncodingError,
+	urllib3.exceptions.HTTPError
+)
+UNSAFE_FILENAME_CHARS = str.maketrans("", "", '\\/:*?"<>|')  # translation table deleting characters not allowed in file names
+# bytes that must appear in a page for it to be worth parsing, one of which needs to be present
+SEARCH_RESULT_MARKERS = (b"post-title",)
+DOWNLOAD_LINK_MARKERS = (b"Download Now", b"DOWNLOAD NOW", b"Main Server", b"MEDIAFIRE")
+PAGE_CACHE_PATH = Path(tempfile.gettempdir()) / "getcomics_cache"  # sqlite cache of fetched html pages
+PAGE_CACHE_EXPIRY = 3600  # seconds before a cached page is fetched again
+LINK_CACHE_PATH = Path("~/.cache/getcomics/pages.json").expanduser()  # download links found on each page
+LINK_CACHE_EXPIRY = 7 * 24 * 60 * 60  # seconds before a page's download links are looked up again
+USER_AGENT = "getcomics-cli (+https://github.com/darylkell/getcomics.info)"  # identifies this tool to the host
+
+_link_cache_lock = threading.Lock()  # queries may save the link cache from different threads
+# shared by every query, so MAX_CONCURRENT_REQUESTS holds however many queries are searching at once
+_page_fetch_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+
+def create_session() -> CachedSession:
+	"""
+	Returns an HTTP session for talking to getcomics.info, which can be shared between queries.
+
+	One session is used for every request, so connections to the host are kept alive and reused,
+	and pages are cached on disk so repeating a search doesn't have to fetch them again.
+	"""
+	session = CachedSession(
+		cache_name=str(PAGE_CACHE_PATH),
+		backend="sqlite",
+		expire_after=PAGE_CACHE_EXPIRY,
+		allowable_methods=("GET",),
+		stale_if_error=True
+	)
+	adapter = HTTPAdapter(
+		pool_connections=16,
+		pool_maxsize=16,
+		max_retries=Retry(total=3, backoff_factor=0.3)
+	)
+	# some download links are plain http, so pool and retry those the same way
+	session.mount("https://", adapter)
+	session.mount("http://", adapter)
+	# html compresses well, so also accept brotli (decoded by urllib3 when the brotli package is installed)
+	session.headers.update({
+		"User-Agent": USER_AGENT,
+		"Connection": "keep-alive",
+		"Accept-Encoding": "gzip, deflate, br"
+	})
+	return session
+
+
+def _load_link_cache() -> dict:
+	"""
+	Returns the saved download links for each page, dict[str, dict]: url, {"fetched_at": timestamp, "links": list[str]}
+	"""
+	try:
+		with open(LINK_CACHE_PATH, encoding="utf-8") as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return {}
+
 
 class Query:
 	"""
 	Object to take a user's search string and provide an interface to getcomics.info results 
 	"""
-	def __init__(self, query: str, results: str, verbose: bool, download_path: Path):
+	def __init__(self, query: str, results: str, verbose: bool, download_path: Path, session=None):
 		self.query = query
 		self.num_results_desired = results
 		self.verbose = verbose
-		self.download_path = download_path
+		self.download_path = Path(download_path).expanduser().resolve()
+		self.download_path.mkdir(parents=True, exist_ok=True)
 		self.page_links = {}  # pages hosting comics, dict[str, str]: url, title
 		self.comic_links = {} # actual links to comics, dict[str, str]: url, title
+		self._dir_cache = {}  # names in each download directory, plus those claimed by downloads, dict[Path, set[str]]
+		self._file_name_lock = threading.Lock()
+		self._stop_downloads = threading.Event()
+		self._stop_search = threading.Event()
+		# pages are fetched for get_download_links as soon as find_pages finds them
+		self._page_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
+		self._page_trees = {}  # pending fetches of pages in page_links, dict[str, Future]
+		self._fetched_pages = set()  # pages in page_links whose download links have been recorded
+		self._link_cache = _load_link_cache()
+		self._new_link_cache_entries = {}
+		self._resolved_urls = {}  # where each comic link ends up after redirects, dict[str, str]: url, final url
+		self._sizes: dict[str, int] = {}  # sizes of the files at resolved comic links, where given
+
+		# share the session between queries where given, so they reuse the same connections
+		self._owns_session = session is None
+		self.session = session if session is not None else create_session()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		"""
+		Stops any outstanding page fetches, and closes the HTTP session and its pooled connections
+		unless the session was given to the Query to share.
+		"""
+		self._page_executor.shutdown(cancel_futures=True)
+		if self._owns_session:
+			self.session.close()
+
+	def stop(self):
+		"""
+		Stops the query's searching and downloading from another thread, eg: on KeyboardInterrupt.
+		Requests already underway are left to finish, but no more are started.
+		"""
+		self._stop_search.set()
+		self._stop_downloads.set()
 
 	def find_pages(self, date=None):
 		"""
 		Uses the search query to find pages that can later be parsed for download links.
 
+		Search result pages are fetched concurrently in batches that grow from a single page
+		up to MAX_CONCURRENT_REQUESTS pages, as the number of result pages is not known up front.
+		A batch is never more pages than the results still wanted could be spread over.
+		Results are still processed in page order. Each page found starts being fetched for
+		get_download_links straight away, so the two stages overlap.
+
 		date (None | datetime): date to look for in search results, or newer
 		"""
-		# treat 0 as infinite desired results
+		self._find_pages(date)
+		if self.verbose:
+			print(f"{len(self.page_links):,} pages found containing matching comics.")
+
+	def _find_pages(self, date=None):
 		page = 0
-		while self.num_results_desired == 0 or len(self.page_links) < self.num_results_desired:
-			page += 1
-			url = f"{BASE_URL}/page/{page}?s={quote_plus(self.query)}"
-			try:
+		batch_size = 1
+		results_per_page = None  # known once the first page of results is in
+		get_results = partial(self._get_soup, markers=SEARCH_RESULT_MARKERS, parse_only=SoupStrainer("article"))
+		executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
+		try:
+			# treat 0 as infinite desired results
+			while self.num_results_desired == 0 or len(self.page_links) < self.num_results_desired:
+				if self._stop_search.is_set():
+					return
+				if self.num_results_desired and results_per_page:
+					# don't fetch ahead past the pages the remaining results can be on
+					pages_needed = math.ceil((self.num_results_desired - len(self.page_links)) / results_per_page)
+					batch_size = min(batch_size, pages_needed)
+				urls = [self._search_url(page + i) for i in range(1, batch_size + 1)]
+				page += batch_size
+				batch_size = min(batch_size * 2, MAX_CONCURRENT_REQUESTS)
+
+				for soup in executor.map(get_results, urls):
+					if soup is None or self._stop_search.is_set():
+						return
+					articles = soup.findAll("article")
+					if len(articles) == 0:
+						return
+					if results_per_page is None:
+						results_per_page = len(articles)
+
+					# only take as many articles as are still wanted
+					remaining = self.num_results_desired - len(self.page_links) if self.num_results_desired else None
+					for article in islice(articles, remaining):
+						title_tag = article.select_one("h1.post-title")
+						title = title_tag.text
+						link = title_tag.find("a")["href"]
+						article_time = article.find("time")["datetime"]
+						
+						# should start in the format "2023-10-08" for Oct 8 2023
+						if date and datetime.fromisoformat(article_time[:10]) < date:
+							return  # don't bother looking at more articles because the articles are sorted by date
+						self._fetch_page_tree(link)
+						self.page_links[link] = title
+
+					if self.num_results_desired and len(self.page_links) >= self.num_results_desired:
+						return
+		finally:
+			# don't wait on pages fetched ahead that are no longer wanted, eg: once past the date cutoff
+			executor.shutdown(wait=False, cancel_futures=True)
+
+	def _search_url(self, page: int) -> str:
+		"""Returns the url of the given page of search results for the query."""
+		return f"{BASE_URL}/page/{page}?s={quote_plus(self.query)}"
+
+	def _get(self, url):
+		"""
+		Fetches url, returning None if it could not be contacted.
+		Safe to call from worker threads, though no more than MAX_CONCURRENT_REQUESTS are fetched at once.
+		"""
+		try:
+			with _page_fetch_slots:
 				if self.verbose: print(f"Opening page {url}")
-				response = requests.get(url)
-			except Exception as e:
-				print(f"Error contacting URL: {url}")
-				print(e)
-			
-			soup = BeautifulSoup(response.text, "html.parser")
-			articles = soup.findAll("article")
-			if len(articles) == 0:
-				return
+				return self.session.get(url, timeout=REQUEST_TIMEOUT)
+		except Exception as e:
+			print(f"Error contacting URL: {url}")
+			print(e)
+			return None
 
-			for article in articles:
-				title_tag = article.find("h1", {"class": "post-title"})
-				title = title_tag.text
-				link = title_tag.find("a")["href"]
-				article_time = article.find("time")["datetime"]
-				
-				if date:
-					year, month, day = article_time.split("-")  # should be in the format "2023-10-08" for Oct 8 2023
-					if datetime(year=int(year), month=int(month), day=int(day)) < date:
-						return  # don't bother looking at more articles because the articles are sorted by date
-				self.page_links[link] = title
+	def _get_soup(self, url, markers=(), parse_only=None):
+		"""
+		Fetches and parses url with BeautifulSoup, returning None if the page could not be retrieved.
+		Run from worker threads so that parsing overlaps with other fetches.
 
-		if self.verbose:
-			print(f"{len(self.page_links):,} pages found containing matching comics.")
+		markers (tuple[bytes]): if given, pages containing none of these are not parsed, and an empty document is returned
+		parse_only (None | SoupStrainer): only build the parts of the page that match this
+		"""
+		response = self._get(url)
+		if response is None:
+			return None
+		if markers and not any(marker in response.content for marker in markers):
+			return BeautifulSoup("", "lxml")
+		return BeautifulSoup(response.content, "lxml", parse_only=parse_only)
+
+	def _get_tree(self, url, markers=()):
+		"""
+		Fetches and parses url with selectolax, returning None if the page could not be retrieved.
+		Much quicker than BeautifulSoup when only a few tags need to be selected from the page.
+
+		markers (tuple[bytes]): if given, pages containing none of these are not parsed, and an empty document is returned
+		"""
+		response = self._get(url)
+		if response is None:
+			return None
+		if markers and not any(marker in response.content for marker in markers):
+			return HTMLParser("")
+		return HTMLParser(response.content)
 
 	def get_download_links(self):
 		"""
@@ -72,149 +268,478 @@ class Query:
 		
 		*TODO*: Does not yet handle a page that has multiple links, such as:
 			https://getcomics.org/other-comics/buffy-the-vampire-slayer-season-8-library-edition-vol-1-4-2012-2013/
-		
+
+		Pages are fetched and parsed concurrently, but links are recorded in page order.
+		Links found on a page are saved for a week, so pages seen by a previous search aren't fetched again.
 		"""
+		for url in self.page_links:
+			self._fetch_page_tree(url)
 		for url, title in self.page_links.items():
+			if self._stop_search.is_set():
+				break
+			if url in self._fetched_pages:
+				continue
+			links = self._cached_links(url)
+			if links is None:
+				self._fetch_page_tree(url)  # in case its cached links went stale since find_pages
+				tree = self._page_trees.pop(url).result()
+				if tree is None:
+					continue
+				links = self._find_download_links(url, tree)
+				if links:
+					self._new_link_cache_entries[url] = {"fetched_at": time.time(), "links": links}
+			for link in links:
+				self.comic_links[link] = title
+			self._fetched_pages.add(url)
+		if self._new_link_cache_entries:
+			self._save_link_cache()
+
+	def _fetch_page_tree(self, url):
+		"""
+		Starts fetching and parsing url in the background, unless it is already underway
+		or its download links are already known.
+		"""
+		if url in self._page_trees or url in self._fetched_pages or self._cached_links(url) is not None:
+			return
+		self._page_trees[url] = self._page_executor.submit(self._get_tree, url, DOWNLOAD_LINK_MARKERS)
+
+	def _cached_links(self, url):
+		"""
+		Returns the download links previously found on the page at url, or None if they aren't known or are stale.
+		"""
+		entry = self._link_cache.get(url)
+		if entry is None or time.time() - entry["fetched_at"] > LINK_CACHE_EXPIRY:
+			return None
+		return entry["links"]
+
+	def _save_link_cache(self):
+		"""
+		Adds the newly found download links to the link cache file, dropping stale entries.
+		The file is re-read first, as other queries may have saved to it in the meantime.
+		"""
+		with _link_cache_lock:
+			cache = _load_link_cache()
+			cache.update(self._new_link_cache_entries)
+			now = time.time()
+			cache = {url: entry for url, entry in cache.items() if now - entry["fetched_at"] <= LINK_CACHE_EXPIRY}
+			temp_file = LINK_CACHE_PATH.with_name(LINK_CACHE_PATH.name + ".part")
 			try:
-				if self.verbose: print(f"Opening page {url}")
-				response = requests.get(url)
-			except Exception as e:
-				print(f"Error contacting URL: {url}")
-				print(e)
-
-			soup = BeautifulSoup(response.text, "html.parser")
-			native_download_a_tags = soup.findAll("a", {"title": "Download Now"})
-			native_download_a_tags += soup.findAll("a", {"title": "DOWNLOAD NOW"})
-			main_server_a_tags = soup.findAll("a", text="Main Server")
-			mediafire_download_a_tags = soup.findAll("a", {"title": "MEDIAFIRE"})
-
-			if not native_download_a_tags and not main_server_a_tags:
-				if self.verbose: print(f"Couldn't find a native download link on page {url}")
-				if mediafire_download_a_tags:
-					# prepend URL so we know it is MEDIAFIRE
-					for tag in mediafire_download_a_tags:
-						self.comic_links[f"_MEDIAFIRE_{tag['href']}"] = title
-			if native_download_a_tags:
-				for tag in native_download_a_tags:
-					self.comic_links[tag["href"]] = title
-			if main_server_a_tags:
-				for tag in main_server_a_tags:
-					self.comic_links[tag["href"]] = title
-			if not native_download_a_tags and not main_server_a_tags and not mediafire_download_a_tags:
-				print("No download links found.")
-
-	def download_comics(self, prompt=False):
-		"""
-		Downloads comics that have been found 
-		"""        
-		for i, (url, title) in enumerate(self.comic_links.items()):
+				LINK_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+				with open(temp_file, "w", encoding="utf-8") as file:
+					json.dump(cache, file)
+				os.replace(temp_file, LINK_CACHE_PATH)
+			except OSError as e:
+				if self.verbose: print(f"Couldn't save download links to {LINK_CACHE_PATH}: {e}")
+				return
+		self._link_cache.update(self._new_link_cache_entries)
+		self._new_link_cache_entries = {}
+
+	def _find_download_links(self, url, tree):
+		"""
+		Returns the download links found in tree, the parsed page at url.
+		"""
+		# sort the page's links in a single pass over them
+		native_download_a_tags, main_server_a_tags, mediafire_download_a_tags = [], [], []
+		for tag in tree.css("a"):
+			tag_title = tag.attributes.get("title")
+			if tag_title in ("Download Now", "DOWNLOAD NOW"):
+				native_download_a_tags.append(tag)
+			elif tag_title == "MEDIAFIRE":
+				mediafire_download_a_tags.append(tag)
+			elif tag.text(strip=True) == "Main Server":
+				main_server_a_tags.append(tag)
+
+		links = []
+		if not native_download_a_tags and not main_server_a_tags:
+			if self.verbose: print(f"Couldn't find a native download link on page {url}")
+			if mediafire_download_a_tags:
+				# prepend URL so we know it is MEDIAFIRE
+				for tag in mediafire_download_a_tags:
+					links.append(f"_MEDIAFIRE_{tag.attributes['href']}")
+		if native_download_a_tags:
+			for tag in native_download_a_tags:
+				links.append(tag.attributes["href"])
+		if main_server_a_tags:
+			for tag in main_server_a_tags:
+				links.append(tag.attributes["href"])
+		if not native_download_a_tags and not main_server_a_tags and not mediafire_download_a_tags:
+			print("No download links found.")
+		return links
+
+	def download_comics(self, prompt=False, parallel=PARALLEL_DOWNLOADS):
+		"""
+		Downloads comics that have been found, up to `parallel` at a time.
+		Mediafire links are printed, and the size of each comic found and any prompting
+		is done before downloading starts.
+		"""
+		downloads = []
+		for url, title in self.comic_links.items():
 			if url.startswith("_MEDIAFIRE_"):
 				print(f"{title}:\nPlease download from the following Mediafire link:\n{url[url.index('http'):]}")
 				continue
-			
-			if self.verbose: print(f"Downloading {title} from {url}")
-
-			# if url doesn't look like a direct file link (some are encoded) try and get file name from the redirect
-			if "." not in url.rpartition("/")[-1]:
-				url = requests.head(url, allow_redirects=True).url
-			
-			file_name = self.safe_filename(unquote(url.rpartition("/")[-1]))
-			file_name = self.create_file_name(str(self.download_path / file_name))
-			
-			if prompt and "n" in input(f"Download '{title}'? (Y/n) ").lower():
-				continue
+			downloads.append((url, title))
+
+		if not downloads:
+			return
 
-			self.download_file(
-				url, 
-				filename=Path(file_name),
-				verbose=True, 
-				transient=True
-			)
+		self._get_sizes(url for url, _ in downloads)
+		sizes = [self._size(url) for url, _ in downloads]
+		known_sizes = [size for size in sizes if size is not None]
+		summary = f"{len(downloads)} comic{'s' if len(downloads) != 1 else ''}, {self._format_size(sum(known_sizes))} total"
+		if len(known_sizes) < len(downloads):
+			summary += f" ({len(downloads) - len(known_sizes)} of unknown size)"
+		print(summary)
+
+		if prompt:
+			chosen = []
+			for (url, title), size in zip(downloads, sizes):
+				size_note = f" ({self._format_size(size)})" if size is not None else ""
+				if "n" not in input(f"Download '{title}'{size_note}? (Y/n) ").lower():
+					chosen.append((url, title))
+			downloads = chosen
+
+		if not downloads:
+			return
+
+		with self._make_progress(verbose=True, transient=True) as progress:
+			with ThreadPoolExecutor(max_workers=parallel) as executor:
+				futures = {executor.submit(self._download_comic, url, title, progress): title for url, title in downloads}
+				try:
+					for future in as_completed(futures):
+						try:
+							future.result()
+						except Exception as e:
+							# only this comic failed, so carry on with the others
+							print(f"'{futures[future]}' failed to download: {e}")
+				except KeyboardInterrupt:
+					# stop the other downloads rather than waiting on them
+					self._stop_downloads.set()
+					for future in futures:
+						future.cancel()
+					raise
+
+	def _download_comic(self, url, title, progress):
+		"""
+		Downloads a single comic into the download path, sharing the given progress display.
+		"""
+		if self.verbose: print(f"Downloading {title} from {url}")
+
+		# some links are encoded, so take the file name from where they redirect to
+		size = self._size(url)
+		url = self._resolved_urls.get(url, url)
+		file_name = self.safe_filename(unquote(url.rpartition("/")[-1]))
+
+		# skip the download if this file has already been downloaded in full
+		existing_file = self.download_path / file_name
+		if size is not None and existing_file.is_file() and existing_file.stat().st_size == size:
+			print(f"'{title}' already downloaded.")
+			return
+
+		# create_file_name claims the name it returns, so simultaneous downloads can't pick the same one
+		with self._file_name_lock:
+			file_path = self.create_file_name(self.download_path / file_name)
+
+		try:
+			downloaded = self.download_file(url, filename=file_path, progress=progress, total_size=size)
+		except (requests.RequestException, *RETRYABLE_DOWNLOAD_ERRORS) as e:
+			# a dead link shouldn't stop the other comics from downloading
+			print(f"'{title}' failed to download: {e}")
+			return
+		if downloaded:
 			print(f"'{title}' downloaded.")
 
-	def download_file(self, url, filename=None, chunk_size=1024, verbose=False, transient=False):
+	def _get_sizes(self, urls):
+		"""
+		Sends a HEAD request for each of the urls at once, recording where they redirect to
+		and the size of the file there, if the server gives one.
+		"""
+		def head(url):
+			try:
+				# ask for the same encoding as download_file, so the size is of the bytes that will be saved
+				return url, self.session.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT, headers={"Accept-Encoding": "identity"})
+			except requests.RequestException as e:
+				if self.verbose: print(f"Couldn't get the size of {url}: {e}")
+				return url, None
+
+		urls = [url for url in urls if url not in self._resolved_urls]
+		with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+			for url, response in executor.map(head, urls):
+				if response is None or not response.ok:
+					continue
+				self._resolved_urls[url] = response.url
+				content_length = response.headers.get("content-length", "")
+				if content_length.isdigit():
+					self._sizes[response.url] = int(content_length)
+
+	def _size(self, url):
+		"""Returns the size of the file the url leads to, or None if it isn't known."""
+		return self._sizes.get(self._resolved_urls.get(url, url))
+
+	def _format_size(self, size: int) -> str:
+		"""Returns size in bytes as a readable string, eg: "1.2 GiB"."""
+		unit, suffix = pick_unit_and_suffix(size, ["bytes", "KiB", "MiB", "GiB", "TiB", "PiB"], 1024)
+		return f"{size:,} {suffix}" if unit == 1 else f"{size / unit:,.1f} {suffix}"
+
+	def _make_progress(self, verbose=False, transient=False):
+		"""
+		verbose (bool): whether or not to display the progress bar
+		transient: make the progress bar disappear on completion
+
+		Returns a progress display which can show any number of downloads.
+		"""
+		return Progress(
+			TextColumn("[progress.description]{task.description}"),
+			TimeRemainingColumn(compact=True),
+			BarColumn(bar_width=20),
+			"[progress.percentage]{task.percentage:>3.1f}%",
+			"•",
+			DownloadColumn(binary_units=True),
+			"•",
+			TransferSpeedColumn(),
+			disable=not verbose,
+			transient=transient
+		)
+
+	def download_file(self, url, filename=None, chunk_size=DOWNLOAD_CHUNK_SIZE, verbose=False, transient=False, progress=None, total_size=None):
 		"""
 		url (str): url to download
 		filename (Path): path to save as
+		chunk_size (int): bytes to read at a time
 		verbose (bool): whether or not to display the progress bar
 		transient: make the progress bar disappear on completion
+		progress (None | Progress): progress display to add this download to, in place of a new one;
+			the download's bar is removed from it once finished
 		
-		Downloads file to OS temp directory, then renames to the final given destination
+		Downloads file to a ".part" file alongside the destination, then renames it to the final
+		given destination. Being on the same filesystem, the rename never has to copy the data.
+		If the connection drops, the download is retried, resuming from the end of the ".part" file
+		where the server supports it and the file there hasn't changed. A ".part" file left by an
+		earlier run is started again, as there's no telling it holds the same file.
+		total_size is the size of the file where already known, otherwise it is read from the response.
+		Returns False if the download was stopped before it completed.
 		"""
-		response = requests.get(url, stream=True)
+		if progress is None:
+			with self._make_progress(verbose, transient) as progress:
+				return self.download_file(url, filename, chunk_size, progress=progress, total_size=total_size)
 
-		# check if a redirect occurred because it could affect the file name being saved (issue #13)
-		if response.history:
-			filename = Path(unquote(Path(response.url).name))
 		destination = filename
-		temp_file = Path(tempfile.gettempdir()) / filename.name
-		
-		total_size_in_bytes = int(response.headers.get('content-length', 0))
-		with open(temp_file, "wb") as file:
-			progress = Progress(
-				TextColumn("[progress.description]{task.description}"),
-				TimeRemainingColumn(compact=True),
-				BarColumn(bar_width=20),
-				"[progress.percentage]{task.percentage:>3.1f}%",
-				"•",
-				DownloadColumn(binary_units=True),
-				"•",
-				TransferSpeedColumn(),
-				disable=not verbose,
-				transient=transient
-			)
-			with progress:
-				task_id = progress.add_task(
-					description=destination.name,
-					total=total_size_in_bytes,
-					visible=not self.verbose
-				)
-				for chunk in response.iter_content(chunk_size=chunk_size):
-					# set up the progress bar so it has the best chance to be displayed nicely, allowing for terminal resizing
-					columns_width = 60 # generally, the Text/TimeRemaining/Bar/Download/TransferSpeed Columns take up this much room
-					terminal_width = shutil.get_terminal_size().columns
-					max_length = max(terminal_width - columns_width, 10)
-					file_name_divided = "\n".join(textwrap.wrap(destination.name, width=max_length))
-
-					file.write(chunk)
-					progress.update(task_id, description=file_name_divided, advance=chunk_size)
-		temp_file.replace(destination)
+		destination.parent.mkdir(parents=True, exist_ok=True)
+		written = 0  # bytes of the file in the ".part" file so far
+		started = False  # whether this download has written to the ".part" file yet
+		resumable = True
+		validator = None  # ETag or Last-Modified of the file, so a resumed download can't mix two versions of it
+		full_size = None
+		task_id = None
+		failed_attempts = 0
+
+		def update_progress(bytes_read):
+			if self._stop_downloads.is_set():
+				raise _DownloadStopped
+			progress.update(task_id, advance=bytes_read)
+
+		try:
+			while True:
+				# never ask for the files compressed, as comic archives already are
+				headers = {"Accept-Encoding": "identity"}
+				if written:
+					headers["Range"] = f"bytes={written}-"
+					if validator:
+						headers["If-Range"] = validator  # the server sends the whole file instead if it has changed
+				try:
+					# never cache the files themselves
+					with self.session.get(url, stream=True, timeout=REQUEST_TIMEOUT, expire_after=DO_NOT_CACHE, headers=headers) as response:
+						# check if a redirect occurred because it could affect the file name being saved (issue #13)
+						if response.history and not started:
+							destination = destination.with_name(unquote(Path(response.url).name))
+							url = response.url
+
+						content_range = response.headers.get("content-range", "")
+						if response.status_code == 416:
+							if content_range == f"bytes */{written}" and written == full_size:
+								break  # the partial download already has the whole file
+							written = 0  # start again from the beginning
+							continue
+						response.raise_for_status()
+
+						content_length = response.headers.get("content-length")
+						if response.status_code == 206:
+							# only carry on if the server is sending the rest of the same file
+							if not content_range.startswith(f"bytes {written}-") or content_range.rpartition("/")[-1] != str(full_size):
+								written = 0
+								continue
+						else:
+							written = 0  # the whole file is being sent, so start again from the beginning
+							full_size = int(content_length) if content_length else None
+							resumable = response.headers.get("accept-ranges") == "bytes"
+							validator = response.headers.get("etag") or response.headers.get("last-modified")
+							if validator and validator.startswith("W/"):
+								validator = None  # weak ETags can't be used with If-Range
+
+						expected_size = written + int(content_length) if content_length else None
+						total_size_in_bytes = total_size or expected_size or 0
+						if task_id is None:
+							task_id = progress.add_task(
+								description=self._progress_description(destination),
+								total=total_size_in_bytes,
+								completed=written,
+								visible=not self.verbose
+							)
+						else:
+							progress.update(task_id, total=total_size_in_bytes, completed=written)
+
+						# read straight from the socket rather than through iter_content's generator
+						response.raw.decode_content = True
+						# raise IncompleteRead if the connection closes early, rather than ending as though the file were complete
+						response.raw.enforce_content_length = True
+						temp_file = destination.with_name(destination.name + ".part")
+						started = True
+						with open(temp_file, "ab" if written else "wb", buffering=WRITE_BUFFER_SIZE) as file, _BackgroundWriter(file) as writer:
+							shutil.copyfileobj(_ProgressReader(response.raw, update_progress), writer, chunk_size)
+
+						# never keep a short file as though it were the whole download
+						received = self._partial_download_size(destination)
+						if expected_size is not None and received != expected_size:
+							raise urllib3.exceptions.IncompleteRead(received, expected_size - received)
+					break
+				except RETRYABLE_DOWNLOAD_ERRORS as e:
+					if self._stop_downloads.is_set():
+						raise _DownloadStopped  # don't retry a download that has been stopped while it stalled
+					failed_attempts += 1
+					if failed_attempts == DOWNLOAD_ATTEMPTS:
+						raise
+					if self.verbose: print(f"Download of {destination.name} interrupted, retrying: {e}")
+					written = self._partial_download_size(destination) if started and resumable else 0
+		except _DownloadStopped:
+			return False
+		finally:
+			# a shared progress display should only show the downloads still underway
+			if task_id is not None:
+				progress.remove_task(task_id)
+		destination.with_name(destination.name + ".part").replace(destination)
+		return True
+
+	def _partial_download_size(self, destination: Path) -> int:
+		"""Returns the number of bytes already downloaded to destination's ".part" file."""
+		try:
+			return destination.with_name(destination.name + ".part").stat().st_size
+		except FileNotFoundError:
+			return 0
+
+	def _progress_description(self, destination: Path) -> str:
+		"""
+		Returns destination's name wrapped to fit alongside the progress bar's other columns,
+		for the terminal's width at the time.
+		"""
+		columns_width = 60 # generally, the Text/TimeRemaining/Bar/Download/TransferSpeed Columns take up this much room
+		terminal_width = shutil.get_terminal_size().columns
+		max_length = max(terminal_width - columns_width, 10)
+		return "\n".join(textwrap.wrap(destination.name, width=max_length))
 
 	def safe_filename(self, filename: str) -> str:
 		"""Returns the filename with characters like \:*?"<>| removed."""
-		return re.sub(r"[\/\\\:\*\?\"\<\>\|]", "", filename)
+		return filename.translate(UNSAFE_FILENAME_CHARS)
 
-	def create_file_name(self, filename: str) -> str:
+	def create_file_name(self, filename: Path) -> Path:
 		""" 
 		Checks to see if a file already exists.
-		If it does, returns a string path with a unique name that does not exist
+		If it does, returns a path with a unique name that does not exist
 		as per the Windows standard ("temp.py" when exists returns "temp (0).py")
+
+		Each directory is only listed once per Query, and the returned name is remembered as taken,
+		so later calls won't return it again even before the file is written.
 		
 		:Parameters:
-		filename (str) - path to be checked
+		filename (Path | str) - path to be checked
 		
 		:Returns:
-		filename (str) - unique filename
+		filename (Path) - unique filename
 		"""
-		filename = filename.replace("\\", "/")
-		if not Path(filename).exists():
-			return filename
-		
-		# account for "." in directory structure
-		if "/" in filename:
-			directories, _, filename = filename.rpartition("/") 
-			directories += "/"
-		else:
-			directories = ""
-		
-		# break down the filename into its parts
-		if "." in filename:
-			stem, _, suffix = filename.rpartition(".")
-			suffix = "." + suffix
-		else:
-			stem, suffix = filename, ""
-
+		path = Path(filename)
+		unique_name = path.name
 		num = 0
-		while Path(f"{directories}{stem} ({num}){suffix}").exists():
+		while self._is_name_taken(path.parent, unique_name):
+			unique_name = f"{path.stem} ({num}){path.suffix}"
 			num += 1
-		return f"{directories}{stem} ({num}){suffix}"
+		self._directory_names(path.parent).add(os.path.normcase(unique_name))
+		return path.with_name(unique_name)
+
+	def _is_name_taken(self, directory: Path, name: str) -> bool:
+		"""
+		Returns whether name is already used in directory. Names in the cached listing are taken, any other
+		name is checked on disk in case the file appeared after the directory was listed.
+		"""
+		return os.path.normcase(name) in self._directory_names(directory) or os.path.lexists(os.path.join(directory, name))
+
+	def _directory_names(self, directory: Path) -> set:
+		"""
+		Returns the (case normalised) names in directory, listing it the first time it is seen.
+		"""
+		if directory not in self._dir_cache:
+			try:
+				with os.scandir(directory) as entries:
+					self._dir_cache[directory] = {os.path.normcase(entry.name) for entry in entries}
+			except FileNotFoundError:
+				self._dir_cache[directory] = set()
+		return self._dir_cache[directory]
+
+
+class _DownloadStopped(Exception):
+	"""Raised to abandon a download part way through."""
+
+
+class _ProgressReader:
+	"""
+	Wraps a file-like object, calling on_read with the number of bytes each read returns.
+	"""
+	def __init__(self, file, on_read):
+		self.file = file
+		self.on_read = on_read
+
+	def read(self, size: int = -1) -> bytes:
+		data = self.file.read(size)
+		self.on_read(len(data))
+		return data
+
+
+class _BackgroundWriter:
+	"""
+	Writes chunks to a file from its own thread, so a download can carry on reading from the
+	network while earlier chunks are being written to disk.
+	"""
+	def __init__(self, file, max_pending: int = 4):
+		self.file = file
+		self._chunks = queue.Queue(maxsize=max_pending)
+		self._error = None
+		self._thread = threading.Thread(target=self._write_chunks, daemon=True)
+		self._thread.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def _write_chunks(self):
+		while True:
+			chunk = self._chunks.get()
+			if chunk is None:
+				return
+			# after a failed write keep draining the queue, so write() can never block forever
+			if self._error is None:
+				try:
+					self.file.write(chunk)
+				except Exception as e:
+					self._error = e
+
+	def write(self, chunk: bytes):
+		"""Queues chunk to be written, raising any error hit writing earlier chunks."""
+		if self._error is not None:
+			raise self._error
+		self._chunks.put(chunk)
+
+	def close(self):
+		"""Waits for all queued chunks to be written."""
+		self._chunks.put(None)
+		self._thread.join()
+		if self._error is not None:
+			raise self._error